@@ -1,43 +1,227 @@
-from datetime import datetime, timezone
+from typing import List, Optional
+import math
+import time
 import numpy as np
 
+try:
+    from numba import njit, prange
 
-def create_overview(array_shape: tuple, array_type: np.dtype, content: bytes, zoom_level: int) -> np.ndarray:
+except ImportError:
+    njit = None
+    prange = range
+
+# The input of each reduction tile is kept within half of a typical per-core L2 cache.
+_TILE_BYTES = 512 * 1024
+
+
+def _overview_uint8(images: np.ndarray, zoom_level: int, out: np.ndarray) -> None:
+    """
+    Write zoom level overviews of a stack of 8-bit image arrays into the output array.  The four pixels of each 2 x 2
+    neighborhood are read as strided views and accumulated with widening adds, so the sums stay in uint16 and the counts
+    in uint8 without copying the images into blocks.  Only the final divide is done in float32.
+
+    :param images: The stack of 8-bit image arrays to create the overviews for.
+    :param zoom_level: The level of the zoom to create the overviews for.
+    :param out: The array to write the overviews into.
+    :return: None
+    """
+    start = 2 ** (zoom_level - 1) - 1
+    step = 2 ** zoom_level
+    rows, cols = out.shape[1] * step, out.shape[2] * step
+
+    sums = np.zeros(out.shape, np.uint16)
+    counts = np.zeros(out.shape, np.uint8)
+    for row in range(start, start + 2):
+        for col in range(start, start + 2):
+            pixel_values = images[:, row:rows:step, col:cols:step]
+            np.add(sums, pixel_values, out=sums)
+            np.add(counts, pixel_values > 0, out=counts)
+
+    # Sums and counts of zero-only neighborhoods are both zero, so they fall out as zero without a separate mask.
+    averages = np.divide(sums, np.maximum(counts, 1), dtype=np.float32)
+    np.copyto(out, np.rint(averages, out=averages), casting='unsafe')
+
+
+def _overview_blocks(images: np.ndarray, zoom_level: int, out: np.ndarray) -> None:
+    """
+    Write zoom level overviews of a stack of image arrays of any data type into the output array.  The images are split
+    into blocks and the masked average of each block is computed with whole-array operations.
+
+    :param images: The stack of image arrays to create the overviews for.
+    :param zoom_level: The level of the zoom to create the overviews for.
+    :param out: The array to write the overviews into.
+    :return: None
+    """
+    start = 2 ** (zoom_level - 1) - 1
+    step = 2 ** zoom_level
+    num_tiles, zoom_rows, zoom_cols, bands = out.shape
+
+    # Split the images into step x step blocks and keep the 2 x 2 neighborhood that straddles the center of each block.
+    blocks = images[:, :zoom_rows * step, :zoom_cols * step].reshape(num_tiles, zoom_rows, step, zoom_cols, step, bands)
+    blocks = blocks[:, :, start:start + 2, :, start:start + 2].swapaxes(2, 3).reshape(
+        num_tiles, zoom_rows, zoom_cols, 4, bands
+    )
+
+    # Zero pixels add nothing to the sums, so only negative and NaN pixels need to be masked out of them, and the sums
+    # and counts of neighborhoods without a positive pixel are both zero, which averages to zero without a branch.
+    weight = blocks > 0
+    counts = weight.sum(axis=3, dtype=np.uint8)
+    if not np.issubdtype(images.dtype, np.unsignedinteger):
+        blocks = np.where(weight, blocks, 0)
+
+    # Sums of four 8 or 16-bit pixels fit in 32 bits and divide exactly enough in single precision, so small integer
+    # types stay in 32-bit arithmetic rather than being promoted to 64 bits.
+    if np.issubdtype(images.dtype, np.integer) and images.itemsize <= 2:
+        sums = blocks.sum(axis=3, dtype=np.uint32)
+        averages = np.divide(sums, np.maximum(counts, 1), dtype=np.float32)
+
+    # Larger types are summed in double precision, as the original average was, because four 64-bit pixels can
+    # overflow a 64-bit integer sum.  The largest 64-bit values round up past the type's maximum in double precision,
+    # so the averages are kept in range before they are cast back.
+    else:
+        averages = blocks.sum(axis=3, dtype=np.float64) / np.maximum(counts, 1)
+        if np.issubdtype(images.dtype, np.integer):
+            np.minimum(averages, np.nextafter(float(np.iinfo(images.dtype).max), 0), out=averages)
+
+    np.copyto(out, np.rint(averages, out=averages), casting='unsafe')
+
+
+def _reduce(images: np.ndarray, start: int, step: int, out: np.ndarray) -> None:
+    """
+    Write the non-zero average of the 2 x 2 neighborhood at the center of each step x step block into the output
+    array.  Each output row is independent, so the rows of every image are distributed across threads when Numba is
+    available.
+
+    :param images: The stack of floating point image arrays to reduce.
+    :param start: The offset of the neighborhood within each block.
+    :param step: The size of each block.
+    :param out: The array to write the overviews into.
+    :return: None
+    """
+    for index in prange(out.shape[0] * out.shape[1]):
+        tile, row = index // out.shape[1], index % out.shape[1]
+        for col in range(out.shape[2]):
+            for band in range(out.shape[3]):
+                total = 0.0
+                count = 0
+                for pixel_row in range(row * step + start, row * step + start + 2):
+                    for pixel_col in range(col * step + start, col * step + start + 2):
+                        value = images[tile, pixel_row, pixel_col, band]
+                        if value > 0:
+                            total += value
+                            count += 1
+
+                out[tile, row, col, band] = np.rint(total / max(count, 1))
+
+
+if njit is not None:
+    _reduce = njit(parallel=True, cache=True, boundscheck=False)(_reduce)
+
+
+def create_overviews_batch(tiles: np.ndarray, zoom_level: int, out: Optional[np.ndarray] = None) -> np.ndarray:
     """
-    Create a zoom level overview of the input image array.  Return an image array of the overview.  The overview pixel
-    size will be a power of 2 larger than the input image which results in a power of 2 fewer pixels.  The power of 2
-    factor is based on the zoom level.  Because the weight in a bilinear interpolation will always be 0.5 in both the
-    x and y direction because of the power of 2 zoom, the result of the both interpolations is equivalent to the
-    average of the non-zero values for the four neighboring pixels.  Thus, the bilinear equation in this routine is
-    simplified to the weighted average of the four neighboring pixels.  The weight applied to each pixel is 1 for
-    non-zero pixels and 0 for zero pixels.
+    Create a zoom level overview of each image array in a stack of tiles.  Return a stack of the overview image arrays.
+    The overview pixel size will be a power of 2 larger than the input image which results in a power of 2 fewer
+    pixels.  The power of 2 factor is based on the zoom level.  Because the weight in a bilinear interpolation will
+    always be 0.5 in both the x and y direction because of the power of 2 zoom, the result of the both interpolations is
+    equivalent to the average of the non-zero values for the four neighboring pixels.  Thus, the bilinear equation in
+    this routine is simplified to the weighted average of the four neighboring pixels.  The weight applied to each pixel
+    is 1 for non-zero pixels and 0 for zero pixels.  The whole stack is reduced at once, so the per-call overhead is
+    shared by every tile.
+
+    :param tiles: The stack of image arrays, shaped (tiles, rows, columns, bands), to create the overviews for.
+    :param zoom_level: The level of the zoom to create the overviews for.
+    :param out: An optional array to write the overviews into, which is reused instead of allocating a new one.
+    :return: The stack of images created.
+    """
+
+    num_tiles, bands = tiles.shape[0], tiles.shape[-1]
+    start = 2 ** (zoom_level - 1) - 1
+    step = 2 ** zoom_level
+    zoom_rows, zoom_cols = tiles.shape[1] // step, tiles.shape[2] // step
+    zoom_shape = (num_tiles, zoom_rows, zoom_cols, bands)
+
+    # Every output pixel is written by the reduction, so the output never needs to be zero filled.
+    if out is None:
+        zoom_images = np.empty(zoom_shape, tiles.dtype)
+
+    elif out.shape != zoom_shape or out.dtype != tiles.dtype:
+        raise ValueError(f'The output array must have shape {zoom_shape} and type {tiles.dtype}.')
+
+    else:
+        zoom_images = out
+
+    if njit is not None and tiles.dtype in (np.float32, np.float64):
+        _reduce(tiles, start, step, zoom_images)
+
+        return zoom_images
+
+    # Reduce the stack in pieces whose input fits in cache: several small tiles at a time, or a square region of a
+    # large tile, so the temporaries of the reduction never spill out to main memory.
+    reduce_tiles = _overview_uint8 if tiles.dtype == np.uint8 else _overview_blocks
+    tiles_per_piece = max(1, _TILE_BYTES // max(tiles[0:1].nbytes, 1))
+    piece_size = max(1, math.isqrt(_TILE_BYTES // (step * step * bands * tiles.itemsize)))
+    for tile in range(0, num_tiles, tiles_per_piece):
+        for row in range(0, zoom_rows, piece_size):
+            for col in range(0, zoom_cols, piece_size):
+                reduce_tiles(
+                    tiles[tile:tile + tiles_per_piece, row * step:(row + piece_size) * step,
+                          col * step:(col + piece_size) * step],
+                    zoom_level,
+                    zoom_images[tile:tile + tiles_per_piece, row:row + piece_size, col:col + piece_size]
+                )
+
+    return zoom_images
+
+
+def create_overview_arr(image: np.ndarray, zoom_level: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Create a zoom level overview of the input image array.  Return an image array of the overview.  See
+    create_overviews_batch for the details of the overview.
+
+    :param image: The image array to create the overview for.
+    :param zoom_level: The level of the zoom to create the overview for.
+    :param out: An optional array to write the overview into, which is reused instead of allocating a new one.
+    :return: The image created.
+    """
+
+    return create_overviews_batch(image[np.newaxis], zoom_level, None if out is None else out[np.newaxis])[0]
+
+
+def create_overview(
+        array_shape: tuple, array_type: np.dtype, content: bytes, zoom_level: int, out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Create a zoom level overview of an image array held in a buffer.  The buffer is viewed in place rather than copied
+    into a new array; see create_overview_arr for the details of the overview.
 
     :param array_shape: The shape of the array to crate from the content.
     :param array_type: The data type of the array.
     :param content: The content of the array as bytes.
     :param zoom_level: The level of the zoom to create the overview for.
+    :param out: An optional array to write the overview into, which is reused instead of allocating a new one.
     :return: The image created.
     """
 
-    image = np.ndarray(array_shape, array_type, content)
-    bands = image.shape[-1]
-    start = 2 ** (zoom_level - 1) - 1
-    step = 2 ** zoom_level
-    zoom_shape = (image.shape[0] // step, image.shape[1] // step, bands)
+    return create_overview_arr(np.frombuffer(content, dtype=array_type).reshape(array_shape), zoom_level, out)
+
 
-    zoom_image = np.zeros(zoom_shape, array_type)
-    for row in range(start, image.shape[0], step):
-        for col in range(start, image.shape[1], step):
-            pixel_values = image[row:row + 2, col:col + 2]
-            if pixel_values.max() > 0:  # At least one color value.
-                weight = pixel_values > 0
-                avg_values = np.round(np.average(pixel_values, (0, 1), weight))
-                zoom_image[row // step, col // step] = avg_values
+def create_pyramid(image: np.ndarray, levels: int) -> List[np.ndarray]:
+    """
+    Create a pyramid of overviews of the input image array.  Each level is the zoom level 1 overview of the level before
+    it, so the whole pyramid costs about 4/3 of a single pass over the input image rather than a full pass per level.
 
-            else:
-                zoom_image[row // step, col // step] = 0
+    :param image: The image array to create the pyramid for.
+    :param levels: The number of overview levels to create.
+    :return: The list of overview images, from the first level to the last.
+    """
 
-    return zoom_image
+    pyramid = list()
+    for _ in range(levels):
+        image = create_overview_arr(image, 1)
+        pyramid.append(image)
+
+    return pyramid
 
 
 # Example usage:
@@ -51,14 +235,21 @@ if __name__ == "__main__":
 
     # Perform bilinear interpolation to reduce resolution
     times = list()
+    out = np.empty((128, 128, 3), np.uint8)
     for tile in range(num_tiles):
-        start_time = datetime.now(timezone.utc).timestamp()
-        create_overview(tiles_256[tile].shape, tiles_256[tile].dtype, tiles_256[tile].tobytes(), level)
-        end_time = datetime.now(timezone.utc).timestamp()
-        delta = end_time - start_time
-        times.append(delta)
+        start_time = time.perf_counter_ns()
+        create_overview_arr(tiles_256[tile], level, out)
+        times.append(time.perf_counter_ns() - start_time)
 
-    average = sum(times) / num_tiles
+    total = sum(times) / 1e9
+    average = total / num_tiles
 
     print(f"Number of tiles: {num_tiles}.")
-    print(f"Time: {sum(times)} seconds; Average: {average} seconds per tile.")
+    print(f"Time: {total} seconds; Average: {average} seconds per tile.")
+
+    # Reduce the whole stack of tiles in a single call
+    start_time = time.perf_counter_ns()
+    create_overviews_batch(tiles_256, level)
+    delta = (time.perf_counter_ns() - start_time) / 1e9
+
+    print(f"Batch time: {delta} seconds; Average: {delta / num_tiles} seconds per tile.")
@@ -1,8 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Optional, Tuple, Any, List
+from typing import Optional, Tuple, Any, List, Dict, Iterable, Iterator
 import zarr
 import numpy as np
 
+from numcodecs import Blosc
 from pyproj import CRS
 
 
@@ -13,6 +15,37 @@ class DimensionType(Enum):
     COORDINATE_Z = 4
 
 
+# The CF axis attribute of each coordinate dimension type.
+_AXES = {DimensionType.COORDINATE_X: 'X', DimensionType.COORDINATE_Y: 'Y', DimensionType.COORDINATE_Z: 'Z'}
+
+
+def _morton_index(x: int, y: int) -> int:
+    """
+    Computes the Morton (Z-order) index of a grid cell by interleaving the bits of its coordinates.
+
+    :param x: The column of the cell.
+    :param y: The row of the cell.
+    :return: The Morton index, with the bits of x in the even positions and the bits of y in the odd positions.
+    """
+    index = 0
+    for bit in range(max(x.bit_length(), y.bit_length())):
+        index |= ((x >> bit) & 1) << (2 * bit) | ((y >> bit) & 1) << (2 * bit + 1)
+
+    return index
+
+
+def morton_order(nx: int, ny: int) -> Iterator[Tuple[int, int]]:
+    """
+    Iterates over the cells of a grid in Morton (Z-order), which keeps cells that are close in space close in the
+    order.
+
+    :param nx: The number of columns in the grid.
+    :param ny: The number of rows in the grid.
+    :return: An iterator of (x, y) cell coordinates.
+    """
+    yield from sorted(((x, y) for y in range(ny) for x in range(nx)), key=lambda cell: _morton_index(*cell))
+
+
 class GeoZarrDataset:
     """
     This class creates and reads GeoZarr datasets.
@@ -20,6 +53,7 @@ class GeoZarrDataset:
     def __init__(self, dataset_path: str, mode: str = 'r') -> None:
         self._dataset_path = dataset_path
         self._mode = mode
+        self._dim_index_cache: Dict[str, Tuple[np.dtype, Dict[Any, int]]] = dict()
 
         match mode:
             case 'r':
@@ -74,6 +108,24 @@ class GeoZarrDataset:
 
             return attributes
 
+        def _compressor(dtype: np.dtype) -> Any:
+            """
+            Chooses the compressor for a data variable.  Floating point data is bit shuffled and integer data is byte
+            shuffled ahead of Zstandard, which suits smoothly varying scientific values.
+
+            :param dtype: The data type of the variable.
+            :return: The compressor, or 'default' for the zarr default compressor.
+            """
+            match np.dtype(dtype).kind:
+                case 'f':
+                    return Blosc(cname='zstd', clevel=3, shuffle=Blosc.BITSHUFFLE)
+
+                case 'i' | 'u':
+                    return Blosc(cname='zstd', clevel=3, shuffle=Blosc.SHUFFLE)
+
+                case _:
+                    return 'default'
+
         if self._mode == 'x':
             if 'global_attributes' in value:
                 self._dataset.attrs.update(value['global_attributes'])
@@ -81,6 +133,7 @@ class GeoZarrDataset:
 
             grid = value['grid'] if 'grid' in value else None
             grid_mapping = dict()
+            grid_ul0 = grid_ul1 = grid_unit = None
             if grid is not None:
                 if 'crs' not in grid:
                     crs_value = CRS.from_epsg(4326)
@@ -101,59 +154,52 @@ class GeoZarrDataset:
                     grid_mapping = _transverse_mercator(crs_value)
                     grid_mapping['spatial_ref'] = grid['crs']
 
-                grid_mapping['projection_x_coordinate'] = grid['upperLeft'][0]
-                grid_mapping['projection_y_coordinate'] = grid['upperLeft'][1]
+                grid_ul0, grid_ul1, grid_unit = grid['upperLeft'][0], grid['upperLeft'][1], grid['unitSize']
+                grid_mapping['projection_x_coordinate'] = grid_ul0
+                grid_mapping['projection_y_coordinate'] = grid_ul1
 
                 del value['grid']
 
             for var in value.keys():
-                var_attr = value[var]['attributes']
-                var_attr['_ARRAY_DIMENSIONS'] = [f'/{var}/{item[0]}' for item in value[var]['dimensions']]
+                var_cfg = value[var]
+                shape = var_cfg['shape']
+                dims = var_cfg['dimensions']
+                var_attr = var_cfg['attributes']
+                var_attr['_ARRAY_DIMENSIONS'] = [f'/{var}/{item[0]}' for item in dims]
                 if grid is not None:
                     var_attr['grid_mapping'] = f'/{var}/crs_grid'
 
-                self._dataset.create_group(var)
-                dimensions = value[var]['dimensions']
-                shape_index = 0
-                for dim in dimensions:
-                    if dim[4] == DimensionType.DIMENSION_VALUE:
-                        self._dataset[var].create_dataset(
-                            dim[0], dtype=dim[3], data=np.empty(value[var]['shape'][shape_index], dim[3])
-                        )
+                group = self._dataset.create_group(var)
+                for shape_index, dim in enumerate(dims):
+                    n = shape[shape_index]
+                    if dim[4] == DimensionType.DIMENSION_VALUE or grid is None:
+                        dim_data = np.empty(n, dim[3])
 
                     elif dim[4] == DimensionType.COORDINATE_X:
-                        self._dataset[var].create_dataset(dim[0], dtype=dim[3], data=[
-                            np.array([
-                                grid['upperLeft'][0] + grid['unitSize'] * index
-                                for index in range(value[var]['shape'][shape_index])
-                            ], dim[3]) if grid is not None
-                            else np.empty(value[var]['shape'][shape_index], dim[3])
-                        ])
+                        dim_data = grid_ul0 + grid_unit * np.arange(n)
 
                     else:
-                        self._dataset[var].create_dataset(dim[0], dtype=dim[3], data=[
-                            np.array([
-                                grid['upperLeft'][1] + grid['unitSize'] * index
-                                for index in range(value[var]['shape'][shape_index])
-                            ], dim[3]) if grid is not None
-                            else np.empty(value[var]['shape'][shape_index], dim[3])
-                        ])
-
-                    self._dataset[var][dim[0]].attrs.update({
+                        dim_data = grid_ul1 + grid_unit * np.arange(n)
+
+                    dim_array = group.create_dataset(dim[0], dtype=dim[3], data=dim_data)
+
+                    dim_array.attrs.update({
                         '_ARRAY_DIMENSION': [f'/{var}/{dim[0]}'],
                         'standard_name': dim[1],
                         'units': dim[2]
                     })
-                    shape_index += 1
-
-                self._dataset[var].create_dataset('crs_grid', dtype='S1', shape=0, chunks=False)
-                self._dataset[var]['crs_grid'].attrs.update(grid_mapping)
-                self._dataset[var].create_dataset(
-                    value[var]['name'], dtype=value[var]['dtype'],
-                    data=np.empty(value[var]['shape'], value[var]['dtype']),
-                    chunks=value[var]['chunks'] if 'chunks' in value[var] else value[var]['shape']
+                    if dim[4] in _AXES:
+                        dim_array.attrs['axis'] = _AXES[dim[4]]
+
+                crs_grid = group.create_dataset('crs_grid', dtype='S1', shape=0, chunks=False)
+                crs_grid.attrs.update(grid_mapping)
+                var_array = group.create_dataset(
+                    var_cfg['name'], dtype=var_cfg['dtype'],
+                    data=np.empty(shape, var_cfg['dtype']),
+                    chunks=var_cfg['chunks'] if 'chunks' in var_cfg else shape,
+                    compressor=var_cfg['compressor'] if 'compressor' in var_cfg else _compressor(var_cfg['dtype'])
                 )
-                self._dataset[var][value[var]['name']].attrs.update(var_attr)
+                var_array.attrs.update(var_attr)
 
         return
 
@@ -162,9 +208,69 @@ class GeoZarrDataset:
 
     def set_index(self, index_name: str, values: np.ndarray) -> None:
         self._dataset[index_name][:] = values
+        self._dim_index_cache.pop(index_name.strip('/'), None)
 
-    # noinspection PyUnusedLocal
-    async def insert(
+    @staticmethod
+    def _index_keys(values: np.ndarray) -> List[Any]:
+        """
+        Converts dimension values into hashable keys.  Date and time values are keyed by their integer count so values
+        read back from zarr and values passed in by the caller compare equal.
+
+        :param values: The dimension values to convert.
+        :return: The list of keys.
+        """
+        return values.view('i8').tolist() if values.dtype.kind in 'mM' else values.tolist()
+
+    def _index_offset(self, index: str, value: Any) -> int:
+        """
+        Looks up the offset of a value in a dimension.  The value to offset mapping of each dimension is read from the
+        dataset once and cached, so repeated inserts do not rescan the dimension.
+
+        :param index: The name of the dimension.
+        :param value: The value to look up.
+        :return: The offset of the first occurrence of the value in the dimension.
+        """
+        # zarr resolves paths with and without the surrounding slashes to the same array, so the cache does too.
+        cache_key = index.strip('/')
+        if cache_key not in self._dim_index_cache:
+            values = self._dataset[index][:]
+            offsets = enumerate(self._index_keys(values))
+            self._dim_index_cache[cache_key] = (values.dtype, {key: offset for offset, key in reversed(list(offsets))})
+
+        dtype, dim_index = self._dim_index_cache[cache_key]
+        try:
+            cast_value = np.asarray(value, dtype)
+
+        except (TypeError, ValueError):
+            raise ValueError(f'{value} is not in {index}')
+
+        # The cast truncates values that do not fit the dimension type, which must not match a dimension value.
+        key = self._index_keys(cast_value)
+        if not bool(cast_value == value) or key not in dim_index:
+            raise ValueError(f'{value} is not in {index}')
+
+        return dim_index[key]
+
+    def _insert_key(self, dimensions: List[str], indexes: Optional[List[Tuple[str, Any]]]) -> tuple:
+        """
+        Builds the key that selects the part of a dataset variable addressed by the indexes.
+
+        :param dimensions: The dimension names of the dataset variable.
+        :param indexes: A list of one or more tuples, upto the shape of the dataset, that contain the dim name and value.
+        :return: A tuple with the offset of each indexed dimension and a full slice for every other dimension.
+        """
+        key = list()
+        index_keys = [item[0] for item in indexes] if indexes is not None else list()
+        for index in dimensions:
+            if index in index_keys:
+                index_key_offset = index_keys.index(index)
+                key.append(self._index_offset(index, indexes[index_key_offset][1]))
+            else:
+                key.append(slice(None))
+
+        return tuple(key)
+
+    def insert(
             self, dataset_name: str, data: np.ndarray, indexes: Optional[List[Tuple[str, Any]]] = None
     ) -> None:
         """
@@ -175,15 +281,38 @@ class GeoZarrDataset:
         :param indexes: A list of one or more tuples, upto the shape of the dataset, that contain the dim name and value.
         :return: None
         """
-        index_expr = f'self._dataset["{dataset_name}"]'
-        index_keys = [item[0] for item in indexes]
-        for index in self._dataset[dataset_name].attrs['_ARRAY_DIMENSIONS']:
-            if index in index_keys:
-                index_key_offset = index_keys.index(index)
-                index_offset = list(self._dataset[index][:]).index(indexes[index_key_offset][1])
-                index_expr += f'[{index_offset}]'
-            else:
-                index_expr += f'[:]'
+        array = self._dataset[dataset_name]
+        array[self._insert_key(array.attrs['_ARRAY_DIMENSIONS'], indexes)] = data
+
+    def insert_many(
+            self, dataset_name: str, data_iter: Iterable[np.ndarray], indexes_iter: Iterable[List[Tuple[str, Any]]],
+            max_workers: Optional[int] = None
+    ) -> None:
+        """
+        Use to insert many pieces of data into the dataset in parallel.  Each piece is written by a worker thread, so
+        every piece must cover whole chunks that no other piece touches.  The pieces are written in Morton order of
+        their chunks along the X and Y axis dimensions.
+
+        :param dataset_name: The name of the dataset variable to update.
+        :param data_iter: The pieces of data to insert.
+        :param indexes_iter: The indexes of each piece of data, in the same form as the indexes of insert.
+        :param max_workers: The maximum number of worker threads, or None for the ThreadPoolExecutor default.
+        :return: None
+        """
+        array = self._dataset[dataset_name]
+        dimensions = array.attrs['_ARRAY_DIMENSIONS']
+        jobs = [(self._insert_key(dimensions, indexes), data) for data, indexes in zip(data_iter, indexes_iter)]
+
+        # Write the pieces in Morton order of their spatial chunks so neighboring chunks are written close together.
+        axes = [self._dataset[dim].attrs.get('axis') for dim in dimensions]
+        spatial_axes = [axes.index(axis) if axis in axes else None for axis in ('X', 'Y')]
+
+        def _chunk_coordinate(key: tuple, axis: Optional[int]) -> int:
+            return key[axis] // array.chunks[axis] if axis is not None and isinstance(key[axis], int) else 0
+
+        jobs.sort(key=lambda job: _morton_index(*(_chunk_coordinate(job[0], axis) for axis in spatial_axes)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(array.__setitem__, key, data) for key, data in jobs]
 
-        index_expr += ' = data'
-        exec(index_expr)
+        for future in futures:
+            future.result()
@@ -1,9 +1,9 @@
-import asyncio
 import unittest
 import numpy as np
 import xarray as xr
 import zarr
-from os import path
+from numcodecs import Blosc
+from os import path, cpu_count
 from geozarr.factory import GeoZarr
 from geozarr.dataset import DimensionType
 
@@ -56,17 +56,19 @@ class CreateDatasetTestCase(unittest.TestCase):
                 # Insert Data
                 geo_zarr.set_index('/SWE/time', dataset.get_index('time').values)
 
-                loop = asyncio.get_event_loop()
-                futures = set()
+                data_list = list()
+                dim_indexes = list()
                 for index in range(dataset.variables['SWE'].sizes['time']):
-                    data: np.ndarray = dataset.variables['SWE'].values[index]
-                    dim_index = [('/SWE/time', dataset.get_index('time').values[index])]
-                    futures.add(geo_zarr.insert('/SWE/SWE', data, dim_index))
+                    data_list.append(dataset.variables['SWE'].values[index])
+                    dim_indexes.append([('/SWE/time', dataset.get_index('time').values[index])])
 
-                loop.run_until_complete(asyncio.gather(*futures))
-                loop.close()
+                geo_zarr.insert_many('/SWE/SWE', data_list, dim_indexes, max_workers=cpu_count())
 
-        self.assertTrue(True)  # add assertion here
+        result = zarr.open(file_path, mode='r')
+        np.testing.assert_array_equal(result['SWE/SWE'][:], dataset['SWE'].values)
+        self.assertEqual(result['SWE/SWE'].compressor.shuffle, Blosc.BITSHUFFLE)
+        np.testing.assert_allclose(result['SWE/x'][:], 433570.9001397601 + 800 * np.arange(dataset.sizes['x']))
+        np.testing.assert_allclose(result['SWE/y'][:], 4663716.608805167 + 800 * np.arange(dataset.sizes['y']))
 
         print('-------------------')
 
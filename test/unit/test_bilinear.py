@@ -0,0 +1,143 @@
+import unittest
+from unittest import mock
+import numpy as np
+from geozarr.bilinear import create_overview, create_overview_arr, create_overviews_batch, create_pyramid
+
+
+def _reference_overview(image: np.ndarray, zoom_level: int) -> np.ndarray:
+    """
+    Compute an overview one output pixel at a time, the way the original implementation did.
+
+    :param image: The image array to create the overview for.
+    :param zoom_level: The level of the zoom to create the overview for.
+    :return: The image created.
+    """
+    start = 2 ** (zoom_level - 1) - 1
+    step = 2 ** zoom_level
+    zoom_image = np.zeros((image.shape[0] // step, image.shape[1] // step, image.shape[-1]), image.dtype)
+    for row in range(zoom_image.shape[0]):
+        for col in range(zoom_image.shape[1]):
+            pixel_values = image[row * step + start:row * step + start + 2, col * step + start:col * step + start + 2]
+            for band in range(image.shape[-1]):
+                values = pixel_values[..., band][pixel_values[..., band] > 0]
+                zoom_image[row, col, band] = np.round(values.mean()) if values.size > 0 else 0
+
+    return zoom_image
+
+
+class CreateOverviewTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = np.random.default_rng(42)
+        self._image = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+        self._image[rng.random(self._image.shape) < 0.25] = 0  # Sprinkle in no-data values.
+
+    def test_create_overview(self) -> None:
+        """
+        This test compares the vectorized overview against the pixel by pixel reference for several zoom levels.
+
+        :return: None
+        """
+        images = (
+            self._image, self._image.astype(np.uint16) * 251, self._image.astype(np.int16) - 64,
+            self._image.astype(np.uint64) * 2 ** 55, (self._image.astype(np.int64) - 64) * 2 ** 55,
+            self._image.astype(np.float32) / 4
+        )
+        for image in images:
+            for zoom_level in range(1, 4):
+                with self.subTest(dtype=image.dtype, zoom_level=zoom_level):
+                    overview = create_overview(image.shape, image.dtype, image.tobytes(), zoom_level)
+                    np.testing.assert_array_equal(overview, _reference_overview(image, zoom_level))
+
+    def test_create_overview_large_values(self) -> None:
+        """
+        This test verifies that neighborhoods of the largest 64-bit values do not overflow the average.
+
+        :return: None
+        """
+        for image, expected in (
+            (np.full((2, 2, 1), 2 ** 62, np.uint64), 2 ** 62),
+            (np.full((2, 2, 1), np.iinfo(np.uint64).max, np.uint64), np.iinfo(np.uint64).max - 2047),
+            (np.full((2, 2, 1), np.iinfo(np.int64).max, np.int64), np.iinfo(np.int64).max - 1023)
+        ):
+            with self.subTest(dtype=image.dtype, value=image[0, 0, 0]):
+                self.assertEqual(create_overview_arr(image, 1)[0, 0, 0], expected)
+
+    def test_create_overview_arr(self) -> None:
+        """
+        This test verifies that an array input produces the same overview as its byte buffer.
+
+        :return: None
+        """
+        overview = create_overview(self._image.shape, self._image.dtype, self._image.tobytes(), 1)
+        np.testing.assert_array_equal(create_overview_arr(self._image, 1), overview)
+
+        out = np.full((32, 32, 3), 7, np.uint8)
+        self.assertTrue(np.shares_memory(create_overview_arr(self._image, 1, out), out))
+        np.testing.assert_array_equal(out, overview)
+        with self.assertRaises(ValueError):
+            create_overview_arr(self._image, 2, out)
+
+    def test_create_overviews_batch(self) -> None:
+        """
+        This test verifies that a stack of tiles produces the same overviews as reducing each tile on its own.
+
+        :return: None
+        """
+        for tiles in (np.stack([self._image, self._image[::-1]]), np.stack([self._image, self._image[::-1]]) / 4):
+            with self.subTest(dtype=tiles.dtype):
+                overviews = create_overviews_batch(tiles, 2)
+                self.assertEqual(overviews.shape, (2, 16, 16, 3))
+                for tile in range(tiles.shape[0]):
+                    np.testing.assert_array_equal(overviews[tile], create_overview_arr(tiles[tile], 2))
+
+    def test_create_overviews_batch_empty(self) -> None:
+        """
+        This test verifies that an empty stack of tiles produces an empty stack of overviews for every data type.
+
+        :return: None
+        """
+        for dtype in (np.uint8, np.uint16, np.float32):
+            with self.subTest(dtype=dtype):
+                self.assertEqual(create_overviews_batch(np.zeros((0, 8, 8, 3), dtype), 1).shape, (0, 4, 4, 3))
+
+    def test_create_overviews_batch_pieces(self) -> None:
+        """
+        This test verifies that reducing a tile in several cache sized pieces matches the pixel by pixel reference.
+
+        :return: None
+        """
+        image = self._image.astype(np.uint16) * 251
+        with mock.patch('geozarr.bilinear._TILE_BYTES', 1024):
+            for zoom_level in range(1, 3):
+                with self.subTest(zoom_level=zoom_level):
+                    overview = create_overviews_batch(image[np.newaxis, :-3], zoom_level)[0]
+                    np.testing.assert_array_equal(overview, _reference_overview(image[:-3], zoom_level))
+
+    def test_create_overview_no_data(self) -> None:
+        """
+        This test verifies that a block without any non-zero values produces a zero pixel.
+
+        :return: None
+        """
+        image = np.zeros((4, 4, 3), np.uint8)
+        image[0, 0] = [10, 0, 255]
+        image[1, 1] = [13, 0, 0]
+        overview = create_overview(image.shape, image.dtype, image.tobytes(), 1)
+        np.testing.assert_array_equal(overview, [[[12, 0, 255], [0, 0, 0]], [[0, 0, 0], [0, 0, 0]]])
+
+    def test_create_pyramid(self) -> None:
+        """
+        This test verifies that each level of a pyramid is the zoom level 1 overview of the level before it.
+
+        :return: None
+        """
+        pyramid = create_pyramid(self._image, 3)
+        self.assertEqual([level.shape for level in pyramid], [(32, 32, 3), (16, 16, 3), (8, 8, 3)])
+        previous = self._image
+        for level in pyramid:
+            np.testing.assert_array_equal(level, _reference_overview(previous, 1))
+            previous = level
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import zarr
+from geozarr.dataset import DimensionType, GeoZarrDataset, morton_order
+
+
+class MortonOrderTestCase(unittest.TestCase):
+    def test_morton_order(self) -> None:
+        """
+        This test verifies the Z-order traversal of square and non-square grids.
+
+        :return: None
+        """
+        self.assertEqual(list(morton_order(2, 2)), [(0, 0), (1, 0), (0, 1), (1, 1)])
+        self.assertEqual(
+            list(morton_order(4, 2)), [(0, 0), (1, 0), (0, 1), (1, 1), (2, 0), (3, 0), (2, 1), (3, 1)]
+        )
+        self.assertEqual(list(morton_order(3, 3))[-1], (2, 2))
+        self.assertEqual(sorted(morton_order(5, 3)), [(x, y) for x in range(5) for y in range(3)])
+
+
+class IndexOffsetTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self._dataset = GeoZarrDataset(f'{self._directory.name}/index.zarr', 'x')
+        self._dataset.schema = {
+            'var': {
+                'name': 'data',
+                'attributes': {},
+                'shape': (3, 2),
+                'dtype': np.float64,
+                'dimensions': [
+                    ('value', 'value', '1', np.int64, DimensionType.DIMENSION_VALUE),
+                    ('day', 'time', 'd', np.dtype('<M8[D]'), DimensionType.DIMENSION_VALUE)
+                ]
+            }
+        }
+        self._dataset.set_index('/var/value', np.array([10, 20, 30]))
+        self._dataset.set_index('/var/day', np.array(['2020-01-01', '2020-01-02'], 'M8[D]'))
+
+    def tearDown(self) -> None:
+        self._directory.cleanup()
+
+    def test_index_offset(self) -> None:
+        """
+        This test verifies that dimension values are found through the cache and that values missing from the
+        dimension, or only matching it after a lossy cast, raise a ValueError.
+
+        :return: None
+        """
+        self.assertEqual(self._dataset._index_offset('/var/value', 20), 1)
+        self.assertEqual(self._dataset._index_offset('/var/value', 20.0), 1)
+        self.assertEqual(self._dataset._index_offset('/var/day', np.datetime64('2020-01-02')), 1)
+        self.assertIn('var/value', self._dataset._dim_index_cache)
+        for index, value in (
+            ('/var/value', 40), ('/var/value', 20.9), ('/var/value', '20'), ('/var/value', 'abc'),
+            ('/var/day', np.datetime64('2020-01-02T12'))
+        ):
+            with self.subTest(index=index, value=value):
+                with self.assertRaises(ValueError):
+                    self._dataset._index_offset(index, value)
+
+    def test_set_index_clears_cache(self) -> None:
+        """
+        This test verifies that replacing the values of a dimension discards its cached offsets.
+
+        :return: None
+        """
+        self.assertEqual(self._dataset._index_offset('/var/value', 30), 2)
+        self._dataset.set_index('/var/value', np.array([30, 40, 50]))
+        self.assertEqual(self._dataset._index_offset('/var/value', 30), 0)
+        with self.assertRaises(ValueError):
+            self._dataset._index_offset('/var/value', 10)
+
+        # The dimension path is normalized, so an alias of the path clears the same cached offsets.
+        self._dataset.set_index('var/value', np.array([50, 40, 30]))
+        self.assertEqual(self._dataset._index_offset('/var/value', 30), 2)
+        self.assertEqual(self._dataset._index_offset('var/value/', 50), 0)
+
+    def test_insert(self) -> None:
+        """
+        This test verifies that insert writes to the offsets of the indexed dimensions and across the whole of every
+        dimension that is not indexed.
+
+        :return: None
+        """
+        self._dataset.insert('/var/data', np.zeros((3, 2)))
+        self._dataset.insert('/var/data', np.array([1.0, 2.0]), [('/var/value', 30)])
+        self._dataset.insert('/var/data', np.array([3.0, 4.0, 5.0]), [('/var/day', np.datetime64('2020-01-01'))])
+        self._dataset.insert('/var/data', 6.0, [('/var/day', np.datetime64('2020-01-02')), ('/var/value', 10)])
+        np.testing.assert_array_equal(
+            zarr.open(f'{self._directory.name}/index.zarr', mode='r')['var/data'][:],
+            [[3.0, 6.0], [4.0, 0.0], [5.0, 2.0]]
+        )
+
+
+class InsertManyTestCase(unittest.TestCase):
+    def test_insert_many_morton_order(self) -> None:
+        """
+        This test verifies that pieces indexed on the spatial dimensions of projected and geographic grids are written
+        in Morton order of their chunks and that every piece is stored at its own location.
+
+        :return: None
+        """
+        for x_name, y_name, units in (
+            ('projection_x_coordinate', 'projection_y_coordinate', 'm'), ('longitude', 'latitude', 'degrees')
+        ):
+            with self.subTest(x_name=x_name), tempfile.TemporaryDirectory() as directory:
+                dataset = GeoZarrDataset(f'{directory}/insert.zarr', 'x')
+                dataset.schema = {
+                    'grid': {'upperLeft': [100.0, 200.0], 'unitSize': 10, 'crs': 'EPSG:4326'},
+                    'var': {
+                        'name': 'data',
+                        'attributes': {},
+                        'shape': (4, 4),
+                        'chunks': [1, 1],
+                        'dtype': np.float64,
+                        'dimensions': [
+                            ('y', y_name, units, np.float64, DimensionType.COORDINATE_Y),
+                            ('x', x_name, units, np.float64, DimensionType.COORDINATE_X)
+                        ]
+                    }
+                }
+
+                data_list = list()
+                dim_indexes = list()
+                for row in range(4):
+                    for col in range(4):
+                        data_list.append(np.float64(row * 4 + col + 1))
+                        dim_indexes.append([('/var/y', 200.0 + 10 * row), ('/var/x', 100.0 + 10 * col)])
+
+                writes = list()
+                setitem = zarr.Array.__setitem__
+
+                def _record(array: zarr.Array, key: tuple, value: np.ndarray) -> None:
+                    writes.append(key)
+                    setitem(array, key, value)
+
+                with mock.patch.object(zarr.Array, '__setitem__', _record):
+                    dataset.insert_many('/var/data', data_list, dim_indexes, max_workers=1)
+
+                self.assertEqual(writes, [(y, x) for x, y in morton_order(4, 4)])
+                np.testing.assert_array_equal(zarr.open(f'{directory}/insert.zarr', mode='r')['var/data'][:],
+                                              np.arange(1, 17, dtype=np.float64).reshape(4, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()